@@ -1,6 +1,9 @@
 from pysaucenao.saucenao import SauceNao
 from pysaucenao.containers import GenericSource, PixivSource, BooruSource, VideoSource, MangaSource, AnimeSource
+from pysaucenao.deadline import Deadline
 from pysaucenao.errors import *
+from pysaucenao.proxies import ProxyPool
+from pysaucenao.remote import RemoteSauceNao
 
 __author__      = 'FujiMakoto'
 __copyright__   = 'Copyright 2020, Taiga Development'
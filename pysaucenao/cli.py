@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import typing
+
+from pysaucenao.daemon import DEFAULT_PORT, LookupDaemon
+from pysaucenao.saucenao import SauceNao
+from pysaucenao.scan import DirectoryScanner, IMAGE_EXTENSIONS, ScanJournal
+
+
+def _run_until_complete(coro: typing.Awaitable) -> typing.Any:
+    # asyncio.run() is only available on Python 3.7+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+def _scan(args: argparse.Namespace) -> int:
+    if not os.path.isdir(args.directory):
+        print(f"{args.directory} is not a directory", file=sys.stderr)
+        return 2
+
+    journal = ScanJournal(args.journal)
+    sauce = SauceNao(api_key=args.api_key, min_similarity=args.min_similarity, results_limit=args.results_limit)
+    scanner = DirectoryScanner(sauce, journal, concurrency=args.concurrency, extensions=args.extensions)
+
+    async def _run():
+        try:
+            return await scanner.run(args.directory)
+        finally:
+            await sauce.close()
+
+    try:
+        stats = _run_until_complete(_run())
+    except KeyboardInterrupt:
+        print('Scan interrupted; run the same command again to resume', file=sys.stderr)
+        return 130
+    finally:
+        journal.close()
+
+    print(', '.join(f"{k}={v}" for k, v in stats.items()))
+    return 1 if scanner.stopped else 0
+
+
+def _daemon(args: argparse.Namespace) -> int:
+    sauce = SauceNao(api_key=args.api_key, min_similarity=args.min_similarity, results_limit=args.results_limit)
+    daemon = LookupDaemon(sauce, concurrency=args.concurrency)
+
+    try:
+        _run_until_complete(daemon.serve(args.socket, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+    return 0
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='pysaucenao', description='Unofficial SauceNao API client')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Enable debug logging')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    scan = subparsers.add_parser('scan', help='Look up every image in a directory tree, resuming from a journal')
+    scan.add_argument('directory', help='Directory to scan')
+    scan.add_argument('-j', '--journal', default='pysaucenao-scan.jsonl',
+                      help='Path to the JSONL journal results are written to and resumed from')
+    scan.add_argument('-k', '--api-key', default=os.environ.get('SAUCENAO_API_KEY'),
+                      help='SauceNao API key (defaults to the SAUCENAO_API_KEY environment variable)')
+    scan.add_argument('-c', '--concurrency', type=int, default=2, help='Maximum number of lookups to run at once')
+    scan.add_argument('--min-similarity', type=float, default=50.0)
+    scan.add_argument('--results-limit', type=int, default=6)
+    scan.add_argument('--extensions', nargs='+', default=IMAGE_EXTENSIONS, help='File extensions to look up')
+    scan.set_defaults(func=_scan)
+
+    daemon = subparsers.add_parser('daemon', help='Run a lookup daemon shared by many processes')
+    daemon.add_argument('-s', '--socket', help='Listen on this Unix socket instead of a TCP port')
+    daemon.add_argument('--host', default='127.0.0.1')
+    daemon.add_argument('-p', '--port', type=int, default=DEFAULT_PORT)
+    daemon.add_argument('-k', '--api-key', default=os.environ.get('SAUCENAO_API_KEY'),
+                        help='SauceNao API key (defaults to the SAUCENAO_API_KEY environment variable)')
+    daemon.add_argument('-c', '--concurrency', type=int, default=4, help='Maximum number of lookups to run at once')
+    daemon.add_argument('--min-similarity', type=float, default=50.0)
+    daemon.add_argument('--results-limit', type=int, default=6)
+    daemon.set_defaults(func=_daemon)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,17 @@
 import asyncio
 import logging
+import re
 import reprlib
 import typing
 
 import aiohttp
 
+from pysaucenao.deadline import Deadline
 from pysaucenao.errors import SauceNaoException
 
+if typing.TYPE_CHECKING:
+    from pysaucenao.thumbnails import ThumbnailCache
+
 TYPE_GENERIC    = 'generic'
 TYPE_PIXIV      = 'pixiv'
 TYPE_BOORU      = 'booru'
@@ -60,6 +65,38 @@ INDEXES = {
 
 }
 
+# Patterns used to reduce URL's from different sites down to a canonical post ID, for de-duplicating results.
+# Hosts must start on a label boundary, so e.g. box.com isn't mistaken for x.com
+CANONICAL_URL_PATTERNS = [
+    ('pixiv',       re.compile(r'(?<![\w-])pixiv\.net/(?:[a-z]{2}/)?(?:artworks|i)/(\d+)')),
+    ('pixiv',       re.compile(r'(?<![\w-])pixiv\.net/.*[?&]illust_id=(\d+)')),
+    ('pixiv',       re.compile(r'(?<![\w-])pximg\.net/.*/(\d+)_p\d+')),
+    ('twitter',     re.compile(r'(?<![\w-])(?:twitter|x)\.com/(?:[^/]+|i/web)/status(?:es)?/(\d+)')),
+    ('danbooru',    re.compile(r'(?<![\w-])danbooru\.donmai\.us/(?:posts|post/show)/(\d+)')),
+    ('gelbooru',    re.compile(r'(?<![\w-])gelbooru\.com/index\.php\?.*\bid=(\d+)')),
+    ('yandere',     re.compile(r'(?<![\w-])yande\.re/post/show/(\d+)')),
+    ('konachan',    re.compile(r'(?<![\w-])konachan\.(?:com|net)/post/show/(\d+)')),
+    ('e621',        re.compile(r'(?<![\w-])e621\.net/(?:posts|post/show)/(\d+)')),
+]
+
+
+def canonical_url(url: str) -> typing.Optional[str]:
+    """
+    Reduce a URL to a canonical key, so links to the same post in different formats can be matched
+    Args:
+        url (str): The URL to normalize
+
+    Returns:
+        typing.Optional[str]: A site and post ID (e.g. "pixiv:66106354"), or None if the URL isn't a link to a post on
+            a site we recognize. Other URL's (e.g. an artist's profile) don't identify a single artwork
+    """
+    for site, pattern in CANONICAL_URL_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            return f"{site}:{match.group(1)}"
+
+    return None
+
 
 class SauceNaoResults:
     """
@@ -68,12 +105,13 @@ class SauceNaoResults:
 
     def __init__(self, response: dict, min_similarity: typing.Optional[float] = None,
                  priority: typing.Optional[typing.List[int]] = None, priority_tolerance: float = 10.0,
-                 loop: typing.Optional[asyncio.AbstractEventLoop] = None):
+                 loop: typing.Optional[asyncio.AbstractEventLoop] = None, deadline: typing.Optional[Deadline] = None):
         self._header, self._results = response['header'], response['results']
         self._min_similarity            = min_similarity
         self._priority                  = priority
         self._priority_tolerance        = priority_tolerance
         self._loop                      = loop
+        self.deadline                   = deadline  # Deadline of the lookup these results came from, if any
         self.user_id: str               = self._header['user_id']
         self.account_type: str          = self._header['account_type']
         self.short_limit: str           = self._header['short_limit']
@@ -88,6 +126,59 @@ class SauceNaoResults:
         self._sort_results()
         self.results: typing.List[GenericSource] = [self._process_result(r) for r in self._results]
 
+    def to_dict(self) -> dict:
+        """
+        Serialize these results back into the API response format, after similarity filtering and priority sorting
+        Results can be restored with SauceNaoResults(results.to_dict())
+        Returns:
+            dict
+        """
+        return {'header': self._header, 'results': self._results}
+
+    def merge_duplicates(self) -> int:
+        """
+        Collapse results from different indexes that point to the same artwork into a single result
+        (e.g. a Pixiv result, Booru entries sourced from that Pixiv post, and a Twitter repost linking to it)
+        The highest ranked result of each group is kept, with the best similarity and the union of every duplicate's
+        URL's, authors and characters. The results that were merged into it are available from its duplicates attribute
+        Returns:
+            int: The number of results that were merged away
+        """
+        groups: typing.List[typing.Optional[typing.List[GenericSource]]] = []
+        index: typing.Dict[str, int] = {}  # Canonical key -> group
+
+        for result in self.results:
+            matched = sorted({index[k] for k in result.canonical_keys if k in index})
+            if not matched:
+                group_id = len(groups)
+                groups.append([result])
+            else:
+                # A result may link two previously separate groups together; fold them into the earliest one
+                group_id = matched[0]
+                groups[group_id].append(result)
+                for other_id in matched[1:]:
+                    groups[group_id] += groups[other_id]
+                    for key, value in index.items():
+                        if value == other_id:
+                            index[key] = group_id
+                    groups[other_id] = None
+
+            for key in result.canonical_keys:
+                index[key] = group_id
+
+        merged = []
+        for group in groups:
+            if not group:
+                continue
+
+            # Results were already in ranked order, so keep that order when groups have been folded together
+            group.sort(key=self.results.index)
+            merged.append(group[0]._merge(group[1:]) if len(group) > 1 else group[0])
+
+        removed = len(self.results) - len(merged)
+        self.results = merged
+        return removed
+
     def _process_result(self, result):
         """
         Parse json response into an applicable container object
@@ -108,7 +199,7 @@ class SauceNaoResults:
 
         # Anime
         if header['index_id'] in [21, 22]:
-            return AnimeSource(header, data, self._loop)
+            return AnimeSource(header, data, self._loop, self.deadline)
 
         # Video
         if header['index_id'] in [23, 24]:
@@ -176,6 +267,32 @@ class SauceNaoResults:
             final_results += extra_results
             self._results = final_results
 
+    async def prefetch_thumbnails(self, limit: typing.Optional[int] = None, *,
+                                  cache: typing.Optional['ThumbnailCache'] = None,
+                                  concurrency: int = 4,
+                                  **kwargs) -> typing.List[typing.Optional[typing.Union[str, bytes]]]:
+        """
+        Download the thumbnails for these results concurrently
+        Args:
+            limit (typing.Optional[int]): Only download thumbnails for the top results. Defaults to all results
+            cache (typing.Optional[ThumbnailCache]): Cache to store thumbnails in. If not provided, the raw bytes are
+                returned instead of local paths
+            concurrency (int): Maximum number of simultaneous downloads
+            **kwargs: Additional download options passed to pysaucenao.thumbnails.prefetch_thumbnails
+
+        Returns:
+            typing.List[typing.Optional[typing.Union[str, bytes]]]: A local path (or bytes) for each result, in order,
+                with None for any thumbnails that could not be downloaded
+        """
+        from pysaucenao.thumbnails import prefetch_thumbnails
+
+        results = self.results[:limit] if limit is not None else self.results
+        urls = [r.thumbnail for r in results if r.thumbnail]
+        downloaded = dict(zip(urls, await prefetch_thumbnails(urls, cache=cache, concurrency=concurrency,
+                                                              loop=self._loop, **kwargs)))
+
+        return [downloaded.get(r.thumbnail) for r in results]
+
     def __getitem__(self, item):
         return self.results[item]
 
@@ -244,6 +361,8 @@ class GenericSource:
         self.index:         typing.Optional[str] = None  # The name of the index pulled from. See INDEXES above
         self.index_id:      typing.Optional[int] = None
         self.index_name:    typing.Optional[str] = None
+        self.characters:    typing.Optional[list] = None
+        self.duplicates:    typing.List['GenericSource'] = []  # Results merged into this one, see merge_duplicates
 
         self._parse_data(data)
         self._parse_header(header)
@@ -259,6 +378,41 @@ class GenericSource:
         """
         return self.url
 
+    @property
+    def canonical_keys(self) -> typing.Set[str]:
+        """
+        Canonical keys identifying the artwork this result links to, used to find duplicate results
+        """
+        urls = list(self.urls or [])
+        if self.source_url:
+            urls.append(self.source_url)
+
+        # Source fields aren't always URL's
+        keys = {canonical_url(u) for u in urls if isinstance(u, str)}
+        keys.discard(None)
+        return keys
+
+    def _merge(self, duplicates: typing.List['GenericSource']) -> 'GenericSource':
+        """
+        Merge duplicate results into this one
+        Returns:
+            GenericSource
+        """
+        def _union(*lists):
+            items = []
+            for _list in lists:
+                for item in _list or []:
+                    if item not in items:
+                        items.append(item)
+            return items or None
+
+        self.duplicates = self.duplicates + duplicates
+        self.similarity = max([self.similarity] + [d.similarity for d in duplicates])
+        self.urls = _union(self.urls, *[d.urls for d in duplicates])
+        self.authors = _union(self.authors, *[d.authors for d in duplicates])
+        self.characters = _union(self.characters, *[d.characters for d in duplicates])
+        return self
+
     def _parse_header(self, header: dict):
         """
         Parse data in the header field of a response; called during initialization
@@ -333,6 +487,13 @@ class PixivSource(GenericSource):
     def type(self):
         return TYPE_PIXIV
 
+    @property
+    def canonical_keys(self) -> typing.Set[str]:
+        keys = super().canonical_keys
+        if self.data.get('pixiv_id'):
+            keys.add(f"pixiv:{self.data['pixiv_id']}")
+        return keys
+
     def _parse_data(self, data: dict):
         super()._parse_data(data)
         self.author_url = f"https://www.pixiv.net/member.php?id={data['member_id']}"
@@ -365,6 +526,15 @@ class BooruSource(GenericSource):
     def type(self):
         return TYPE_BOORU
 
+    @property
+    def canonical_keys(self) -> typing.Set[str]:
+        keys = super().canonical_keys
+        if self.danbooru_id:
+            keys.add(f"danbooru:{self.danbooru_id}")
+        if self.gelbooru_id:
+            keys.add(f"gelbooru:{self.gelbooru_id}")
+        return keys
+
     def _parse_data(self, data: dict):
         super()._parse_data(data)
         self.gelbooru_id = data.get('gelbooru_id')
@@ -403,6 +573,12 @@ class TwitterSource(GenericSource):
     def type(self):
         return TYPE_GENERIC
 
+    @property
+    def canonical_keys(self) -> typing.Set[str]:
+        keys = super().canonical_keys
+        keys.add(f"twitter:{self.tweet_id}")
+        return keys
+
     def _parse_data(self, data: dict):
         super()._parse_data(data)
 
@@ -435,6 +611,11 @@ class VideoSource(GenericSource):
     def type(self):
         return TYPE_VIDEO
 
+    @property
+    def canonical_keys(self) -> typing.Set[str]:
+        # Links for these point to a whole series rather than a single image, so they can't identify duplicates
+        return set()
+
     def _parse_data(self, data: dict):
         super()._parse_data(data)
         if 'part' in data:
@@ -455,9 +636,11 @@ class AnimeSource(VideoSource):
     Contains special methods for obtaining anidb, anilist, mal and kitsu ID's
     """
 
-    def __init__(self, header: dict, data: dict, loop: typing.Optional[asyncio.AbstractEventLoop] = None):
+    def __init__(self, header: dict, data: dict, loop: typing.Optional[asyncio.AbstractEventLoop] = None,
+                 deadline: typing.Optional[Deadline] = None):
         self._ids = None
         self._loop = loop
+        self.deadline = deadline
         self._log = logging.getLogger(__name__)
 
         super().__init__(header, data)
@@ -466,31 +649,46 @@ class AnimeSource(VideoSource):
     def type(self):
         return TYPE_ANIME
 
-    async def load_ids(self) -> typing.Dict[str, int]:
+    async def load_ids(self, *, timeout: typing.Optional[typing.Union[float, Deadline]] = None) -> typing.Dict[str, int]:
         """
         Load and return a list of mapped source ID's
         This needs to be explicitly called before utilizing any of the other class helper properties
+        Args:
+            timeout (typing.Optional[typing.Union[float, Deadline]]): Time limit in seconds, or a Deadline to share.
+                Defaults to whatever is left of the Deadline of the lookup this result came from, or 10 seconds if
+                that has already passed
+
+        Raises:
+            RequestTimeoutException: The time limit was exceeded
+
         Returns:
             typing.Dict[str, int]
         """
         if self._ids is not None:
             return self._ids
 
-        self._ids = {}
+        deadline = Deadline.of(timeout)
+        if deadline is None:
+            # Share whatever is left of the lookup's own budget, but don't fail outright once it has run out
+            deadline = self.deadline if self.deadline and not self.deadline.expired else Deadline(10.0)
+        ids = await deadline.run(self._fetch_ids())
+        self._ids = ids
+        return self._ids
+
+    async def _fetch_ids(self) -> typing.Dict[str, int]:
         async with aiohttp.ClientSession(loop=self._loop, raise_for_status=True) as session:
             try:
                 response = await session.get(f"https://relations.yuna.moe/api/ids?source=anidb&id={self.data.get('anidb_aid')}")
                 if response.status == 204:
                     self._log.info("yuna.moe lookup failed for this anime source")
                 else:
-                    self._ids = await response.json() or {}
-                    return self._ids
+                    return await response.json() or {}
             except aiohttp.ClientResponseError as error:
                 self._log.error(f'yuna.moe server is returning a {error.status} error code')
             except aiohttp.ClientError:
                 self._log.error('yuna.moe server appears to be down or is not responding to our requests')
 
-        return self._ids
+        return {}
 
     # ID getters
     @property
@@ -564,6 +762,11 @@ class MangaSource(GenericSource):
     def type(self):
         return TYPE_MANGA
 
+    @property
+    def canonical_keys(self) -> typing.Set[str]:
+        # Links for these point to a whole series rather than a single image, so they can't identify duplicates
+        return set()
+
     def _parse_data(self, data: dict):
         super()._parse_data(data)
         if 'part' in data:
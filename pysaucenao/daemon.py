@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import typing
+
+import aiohttp
+from aiohttp import web
+
+from pysaucenao.containers import SauceNaoResults
+from pysaucenao.deadline import Deadline
+from pysaucenao.errors import *
+from pysaucenao.saucenao import SauceNao
+
+DEFAULT_PORT = 8723
+
+
+def dumps(data: typing.Any) -> str:
+    """
+    Encode a message in the daemon's wire format
+    """
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+
+class LookupScheduler:
+    """
+    Schedules lookups from every connected process through a single SauceNao client.
+    Identical lookups that are in flight at the same time are only sent to SauceNao once, and when the short search
+    limit is reached, lookups are held back and retried once the limit resets rather than failing.
+    """
+
+    def __init__(self, sauce: SauceNao, *, concurrency: int = 4, short_cooldown: float = 30.0, max_retries: int = 2):
+        self.sauce = sauce
+        self.short_cooldown = short_cooldown
+        self.max_retries = max_retries
+
+        self.short_remaining: typing.Optional[int] = None
+        self.long_remaining: typing.Optional[int] = None
+        self.stats: typing.Dict[str, int] = {'submitted': 0, 'coalesced': 0, 'completed': 0, 'failed': 0}
+
+        self._concurrency = concurrency
+        self._semaphore: typing.Optional[asyncio.Semaphore] = None
+        self._cooldown_until = 0.0
+        self._inflight: typing.Dict[str, asyncio.Future] = {}
+        self._log = logging.getLogger(__name__)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    async def submit(self, key: str,
+                     lookup: typing.Callable[[typing.Optional[Deadline]], typing.Awaitable[SauceNaoResults]],
+                     deadline: typing.Optional[Deadline] = None) -> SauceNaoResults:
+        """
+        Submit a lookup job
+        Args:
+            key (str): Identifies the input being looked up, so identical jobs can share a single request
+            lookup (typing.Callable): Coroutine function that performs the lookup within the Deadline it's given
+            deadline (typing.Optional[Deadline]): Deadline for this caller. The lookup itself runs within the deadline
+                of the caller that started it; other callers sharing the same request start their own lookup if it
+                times out before their deadline does
+
+        Returns:
+            SauceNaoResults
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+
+        self.stats['submitted'] += 1
+        while True:
+            future = self._inflight.get(key)
+            started = future is None
+            if started:
+                future = asyncio.ensure_future(self._run(lookup, deadline))
+                future.add_done_callback(lambda f: self._finished(key, f))
+                self._inflight[key] = future
+            else:
+                self.stats['coalesced'] += 1
+
+            # Shielded so one caller giving up doesn't cancel the lookup for everyone else waiting on it
+            shielded = asyncio.shield(future)
+            try:
+                return await deadline.run(shielded) if deadline else await shielded
+            except RequestTimeoutException:
+                # The lookup ran out of time on another caller's deadline, but we still have time left to try again
+                if started or not future.done() or (deadline and deadline.expired):
+                    raise
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+    async def _run(self, lookup: typing.Callable[[typing.Optional[Deadline]], typing.Awaitable[SauceNaoResults]],
+                   deadline: typing.Optional[Deadline]) -> SauceNaoResults:
+        retries = 0
+        while True:
+            async with self._semaphore:
+                delay = self._cooldown_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                try:
+                    results = await lookup(deadline)
+                except ShortLimitReachedException:
+                    if retries >= self.max_retries:
+                        raise
+
+                    retries += 1
+                    self._log.info(f"Short search limit reached, holding lookups for {self.short_cooldown:.0f} seconds")
+                    self._cooldown_until = time.monotonic() + self.short_cooldown
+                    continue
+
+            self.short_remaining, self.long_remaining = results.short_remaining, results.long_remaining
+            if results.short_remaining is not None and results.short_remaining <= 0:
+                self._cooldown_until = time.monotonic() + self.short_cooldown
+
+            return results
+
+    def _finished(self, key: str, future: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if future.cancelled():
+            return
+
+        # Retrieving the exception here also stops asyncio from complaining if every caller had already given up
+        self.stats['failed' if future.exception() else 'completed'] += 1
+
+
+class LookupDaemon:
+    """
+    Long running lookup server, allowing many short-lived processes to share one warm SauceNao client.
+    Lookups are accepted over HTTP, either on a Unix socket or a TCP port, and return serialized SauceNaoResults.
+
+    POST /lookup?url=<url>      Look up an image URL
+    POST /lookup                Look up the image uploaded as the request body
+    GET  /status                Scheduler statistics and the last known search limits
+
+    Both lookup forms accept an optional timeout query parameter, in seconds.
+    """
+
+    def __init__(self, sauce: SauceNao, *, concurrency: int = 4, max_upload_size: int = 20 * 1024 * 1024):
+        self.sauce = sauce
+        self.scheduler = LookupScheduler(sauce, concurrency=concurrency)
+        self.max_upload_size = max_upload_size
+        self._log = logging.getLogger(__name__)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=self.max_upload_size)
+        app.router.add_post('/lookup', self._lookup)
+        app.router.add_get('/status', self._status)
+        app.on_cleanup.append(lambda _: self.sauce.close())
+        return app
+
+    async def serve(self, path: typing.Optional[str] = None, host: str = '127.0.0.1', port: int = DEFAULT_PORT) -> None:
+        """
+        Run the daemon until cancelled
+        Args:
+            path (typing.Optional[str]): Path of the Unix socket to listen on. If not provided, listens on host:port
+            host (str): Host to listen on when not using a Unix socket
+            port (int): Port to listen on when not using a Unix socket
+
+        Returns:
+            None
+        """
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        if path:
+            # Clean up a stale socket left behind by a daemon that didn't shut down cleanly
+            if os.path.exists(path):
+                os.unlink(path)
+            site = web.UnixSite(runner, path)
+        else:
+            site = web.TCPSite(runner, host, port)
+
+        await site.start()
+        self._log.info(f"Listening for lookups on {path or f'{host}:{port}'}")
+        try:
+            while True:
+                await asyncio.sleep(3600)
+        finally:
+            await runner.cleanup()
+
+    async def _lookup(self, request: web.Request) -> web.Response:
+        deadline = None
+        if 'timeout' in request.query:
+            try:
+                deadline = Deadline(float(request.query['timeout']))
+            except ValueError:
+                return self._error(400, 'ValueError', 'timeout must be a number')
+
+        try:
+            if 'url' in request.query:
+                url = request.query['url']
+                lookup = lambda d: self.sauce.from_url(url, timeout=d)
+                results = await self.scheduler.submit(f"url:{url}", lookup, deadline)
+            else:
+                try:
+                    body = await request.read()
+                except web.HTTPRequestEntityTooLarge:
+                    return self._error(413, 'FileSizeLimitException',
+                                       f"Uploads are limited to {self.max_upload_size} bytes")
+                if not body:
+                    return self._error(400, 'ValueError', 'Either a url parameter or an image body is required')
+
+                digest = await asyncio.get_event_loop().run_in_executor(None, lambda: hashlib.sha1(body).hexdigest())
+                lookup = lambda d: self.sauce.from_file(body, timeout=d)
+                results = await self.scheduler.submit(f"sha1:{digest}", lookup, deadline)
+        except SauceNaoException as error:
+            return self._error(422, type(error).__name__, str(error))
+        except aiohttp.ClientError as error:
+            self._log.error(f"Lookup failed: {type(error).__name__} {error}")
+            return self._error(502, type(error).__name__, str(error))
+        except Exception as error:
+            self._log.exception('Lookup failed')
+            return self._error(500, type(error).__name__, str(error))
+
+        return web.Response(text=dumps({'results': results.to_dict()}), content_type='application/json')
+
+    async def _status(self, request: web.Request) -> web.Response:
+        scheduler = self.scheduler
+        return web.Response(text=dumps({
+            'short_remaining': scheduler.short_remaining,
+            'long_remaining': scheduler.long_remaining,
+            'in_flight': scheduler.in_flight,
+            'stats': scheduler.stats,
+        }), content_type='application/json')
+
+    @staticmethod
+    def _error(status: int, error: str, message: str) -> web.Response:
+        return web.Response(status=status, text=dumps({'error': error, 'message': message}),
+                            content_type='application/json')
@@ -0,0 +1,67 @@
+import asyncio
+import time
+import typing
+
+from pysaucenao.errors import RequestTimeoutException
+
+T = typing.TypeVar('T')
+
+
+class Deadline:
+    """
+    A time budget that can be shared across several calls, such as a lookup and its follow-up ID lookups
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires = time.monotonic() + timeout
+
+    @classmethod
+    def of(cls, timeout: typing.Optional[typing.Union[float, 'Deadline']],
+           default: typing.Optional[float] = None) -> typing.Optional['Deadline']:
+        """
+        Get a deadline from either an existing deadline or a timeout in seconds
+        Args:
+            timeout (typing.Optional[typing.Union[float, Deadline]]): A deadline to share, or a timeout in seconds
+            default (typing.Optional[float]): Timeout to use if none was provided
+
+        Returns:
+            typing.Optional[Deadline]: None if there is no time limit
+        """
+        if isinstance(timeout, Deadline):
+            return timeout
+
+        timeout = timeout if timeout is not None else default
+        return cls(timeout) if timeout is not None else None
+
+    @property
+    def remaining(self) -> float:
+        return max(self.expires - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.expires <= time.monotonic()
+
+    async def run(self, awaitable: typing.Awaitable[T]) -> T:
+        """
+        Await something within the remaining budget, cancelling it if the deadline passes
+        Raises:
+            RequestTimeoutException: The deadline passed, or a connect / read timeout was hit
+
+        Returns:
+            The result of the awaitable
+        """
+        if self.expired:
+            # Make sure coroutines we'll never run don't trigger "never awaited" warnings
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise RequestTimeoutException(f"Deadline of {self.timeout} seconds exceeded")
+
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining)
+        except asyncio.TimeoutError as error:
+            # Connect and read timeouts raised by aiohttp are subclasses of asyncio.TimeoutError too
+            raise RequestTimeoutException(str(error) or f"Deadline of {self.timeout} seconds exceeded") from error
+
+    def __repr__(self):
+        return f"<Deadline(timeout={self.timeout}, remaining={self.remaining:.3f})>"
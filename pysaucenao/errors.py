@@ -36,3 +36,7 @@ class BannedException(SauceNaoException):
 
 class UnknownStatusCodeException(SauceNaoException):
     pass
+
+
+class RequestTimeoutException(SauceNaoException):
+    pass
@@ -0,0 +1,326 @@
+import asyncio
+import io
+import logging
+import reprlib
+import statistics
+import typing
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+import aiohttp
+
+from pysaucenao.containers import AnimeSource, GenericSource, SauceNaoResults, VideoSource
+from pysaucenao.deadline import Deadline
+from pysaucenao.errors import SauceNaoException
+
+try:
+    from PIL import Image, ImageSequence
+except ImportError:
+    Image = ImageSequence = None
+
+if typing.TYPE_CHECKING:
+    from pysaucenao.saucenao import SauceNao
+
+_executor: typing.Optional[ProcessPoolExecutor] = None
+
+
+class Frame:
+    """
+    A single frame sampled from an animated image
+    """
+
+    def __init__(self, index: int, offset: float, dhash: int, image: bytes):
+        self.index = index      # Frame number within the animation
+        self.offset = offset    # Position of the frame within the animation, in seconds
+        self.dhash = dhash      # 64-bit perceptual difference hash
+        self.image = image      # The frame encoded as a PNG
+
+    def __repr__(self):
+        return f"<Frame(index={self.index}, offset={self.offset:.2f}, dhash={self.dhash:016x})>"
+
+
+class Scene:
+    """
+    A cluster of perceptually similar frames; only the representative frame is looked up
+    """
+
+    def __init__(self, frame: Frame):
+        self.representative = frame
+        self.frames: typing.List[Frame] = [frame]
+
+    def __repr__(self):
+        return f"<Scene(representative={self.representative.index}, frames={len(self.frames)})>"
+
+
+class FrameMatch:
+    """
+    A source that was matched by one or more scenes of an animated image
+    """
+
+    def __init__(self, source: GenericSource):
+        self.source: GenericSource          = source  # The highest similarity result for this source
+        self.score: float                   = 0.0
+        self.similarity: float              = source.similarity
+        self.scenes: typing.List[Scene]     = []
+        self.timestamps: typing.List[str]   = []
+
+        # For video sources, the estimated position of the animation's first frame within the episode, in seconds
+        self.clip_start: typing.Optional[float] = None
+        self._clip_starts: typing.List[float] = []
+
+    @property
+    def episode(self) -> typing.Optional[str]:
+        return getattr(self.source, 'episode', None)
+
+    def __repr__(self):
+        rep = reprlib.Repr()
+        return f"<FrameMatch(source={self.source}, score={self.score:.2f}, scenes={len(self.scenes)}, clip_start={rep.repr(self.clip_start)})>"
+
+
+class FrameSearchResults:
+    """
+    Merged results for every scene looked up from an animated image
+    """
+
+    def __init__(self, scenes: typing.List[Scene], scene_results: typing.List[SauceNaoResults], frame_count: int,
+                 error: typing.Optional[Exception] = None):
+        self.scenes = scenes
+        self.scene_results = scene_results
+        self.frame_count = frame_count
+        self.error = error  # The error that stopped the remaining scenes from being looked up, if any
+
+        last = scene_results[-1] if scene_results else None
+        # Results without any matches are falsy, so compare against None
+        self.short_remaining: typing.Optional[int] = last.short_remaining if last is not None else None
+        self.long_remaining: typing.Optional[int] = last.long_remaining if last is not None else None
+
+        self.results: typing.List[FrameMatch] = self._merge()
+
+    def _merge(self) -> typing.List[FrameMatch]:
+        """
+        Merge the results of every scene, ranking sources by how much of the animation they matched
+        Returns:
+            typing.List[FrameMatch]
+        """
+        matches: typing.Dict[tuple, FrameMatch] = {}
+        sampled = sum(len(s.frames) for s in self.scenes) or 1
+
+        for scene, results in zip(self.scenes, self.scene_results):
+            weight = len(scene.frames) / sampled
+            for result in results:
+                key = self._key(result)
+                match = matches.get(key)
+                if match is None:
+                    match = matches[key] = FrameMatch(result)
+                elif result.similarity > match.similarity:
+                    match.source, match.similarity = result, result.similarity
+
+                # Each scene only votes once per source, weighted by how many frames it represents
+                if scene not in match.scenes:
+                    match.scenes.append(scene)
+                    match.score += weight * result.similarity
+                    if isinstance(result, VideoSource) and result.timestamp:
+                        match.timestamps.append(result.timestamp)
+                        self._estimate_clip_start(match, scene, result.timestamp)
+
+        # Timestamps from different scenes that agree on the episode are combined into a single estimate
+        for match in matches.values():
+            if match._clip_starts:
+                match.clip_start = statistics.median(match._clip_starts)
+
+        return sorted(matches.values(), key=lambda m: (m.score, m.similarity), reverse=True)
+
+    @staticmethod
+    def _key(result: GenericSource) -> tuple:
+        # Video results from different frames agree when they point to the same episode of the same title
+        if isinstance(result, AnimeSource):
+            return result.index_id, result.anidb_id or result.title, result.episode
+        if isinstance(result, VideoSource):
+            return result.index_id, result.title, result.episode
+
+        return result.index_id, result.url or result.title
+
+    @staticmethod
+    def _estimate_clip_start(match: FrameMatch, scene: Scene, timestamp: str) -> None:
+        # SauceNao timestamps look like "00:07:53 / 00:23:40"; we only care about the first part
+        try:
+            parts = [int(p) for p in timestamp.split('/')[0].strip().split(':')]
+        except ValueError:
+            return
+
+        seconds = 0
+        for part in parts:
+            seconds = seconds * 60 + part
+
+        match._clip_starts.append(max(seconds - scene.representative.offset, 0.0))
+
+    def __getitem__(self, item):
+        return self.results[item]
+
+    def __len__(self):
+        return len(self.results)
+
+    def __bool__(self):
+        return len(self.results) >= 1
+
+    def __repr__(self):
+        rep = reprlib.Repr()
+        rep.maxlist = 4
+        return f"<FrameSearchResults(frames={self.frame_count}, scenes={len(self.scenes)}, short_avail={self.short_remaining}, long_avail={self.long_remaining}, results={rep.repr(self.results)})>"
+
+
+def extract_frames(source: typing.Union[str, bytes], max_frames: int = 120,
+                   thumbnail_size: int = 1024) -> typing.Tuple[int, typing.List[Frame]]:
+    """
+    Decode an animated GIF, WebP or APNG and sample up to max_frames evenly spaced frames from it.
+    This is CPU bound and is intended to be run in a process pool.
+    Args:
+        source (typing.Union[str, bytes]): Path to the image, or the raw image data
+        max_frames (int): Maximum number of frames to sample
+        thumbnail_size (int): Frames larger than this are downscaled before being encoded for upload
+
+    Returns:
+        typing.Tuple[int, typing.List[Frame]]: The total number of frames, and the sampled frames
+    """
+    if Image is None:
+        raise ImportError('Frame sampling requires Pillow; install it with "pip install pysaucenao[frames]"')
+
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+        frame_count = getattr(image, 'n_frames', 1)
+        step = max(frame_count / max_frames, 1)
+        wanted = {int(i * step) for i in range(min(frame_count, max_frames))}
+
+        frames = []
+        offset = 0.0
+        last = max(wanted)
+        for index, frame in enumerate(ImageSequence.Iterator(image)):
+            if index > last:
+                break
+
+            if index in wanted:
+                rgb = frame.convert('RGB')
+                rgb.thumbnail((thumbnail_size, thumbnail_size))
+                buffer = io.BytesIO()
+                rgb.save(buffer, 'PNG')
+                frames.append(Frame(index, offset, dhash(rgb), buffer.getvalue()))
+
+            offset += (frame.info.get('duration') or 0) / 1000
+
+        return frame_count, frames
+
+
+def dhash(image: 'Image.Image', hash_size: int = 8) -> int:
+    """
+    Compute the difference hash of an image
+    Returns:
+        int
+    """
+    pixels = list(image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            offset = row * (hash_size + 1) + col
+            value = (value << 1) | (pixels[offset] > pixels[offset + 1])
+
+    return value
+
+
+def cluster_frames(frames: typing.List[Frame], threshold: int = 10) -> typing.List[Scene]:
+    """
+    Group frames into scenes of perceptually similar frames
+    Args:
+        frames (typing.List[Frame]): The sampled frames
+        threshold (int): Maximum hamming distance between two frame hashes for them to be considered the same scene
+
+    Returns:
+        typing.List[Scene]: Scenes ordered by the number of frames they contain, largest first
+    """
+    scenes: typing.List[Scene] = []
+    for frame in frames:
+        for scene in scenes:
+            if bin(frame.dhash ^ scene.representative.dhash).count('1') <= threshold:
+                scene.frames.append(frame)
+                break
+        else:
+            scenes.append(Scene(frame))
+
+    # Use the middle frame of each scene as its representative, as the first is more likely to be a transition
+    for scene in scenes:
+        scene.representative = scene.frames[len(scene.frames) // 2]
+
+    return sorted(scenes, key=lambda s: len(s.frames), reverse=True)
+
+
+async def lookup_frames(sauce: 'SauceNao',
+                        path_or_fh: typing.Union[str, typing.BinaryIO, bytes, bytearray, memoryview], *,
+                        max_lookups: int = 4,
+                        max_frames: int = 120,
+                        threshold: int = 10,
+                        timeout: typing.Optional[typing.Union[float, Deadline]] = None,
+                        executor: typing.Optional[Executor] = None) -> FrameSearchResults:
+    """
+    Look up an animated image by querying one representative frame from each distinct scene
+    If a lookup fails after some scenes have already been looked up, or the short search limit runs out, the scenes
+    looked up so far are returned rather than discarding the queries already spent on them
+    Args:
+        sauce (SauceNao): The client to perform lookups with
+        path_or_fh (typing.Union[str, typing.BinaryIO, bytes, bytearray, memoryview]): Path to the file to open, a file
+            like object, or a buffer containing the image
+        max_lookups (int): Maximum number of scenes to look up. Each lookup uses a query from your quota
+        max_frames (int): Maximum number of frames to sample from the animation
+        threshold (int): Maximum perceptual hash distance for two frames to be considered the same scene
+        timeout (typing.Optional[typing.Union[float, Deadline]]): Time limit shared by every scene lookup. Defaults to
+            the client's timeout setting for each lookup
+        executor (typing.Optional[Executor]): Executor to decode frames in. Defaults to a shared process pool
+
+    Raises:
+        SauceNaoException: The first scene lookup failed
+
+    Returns:
+        FrameSearchResults
+    """
+    if Image is None:
+        raise ImportError('Frame sampling requires Pillow; install it with "pip install pysaucenao[frames]"')
+
+    loop = asyncio.get_event_loop()
+    if isinstance(path_or_fh, str):
+        source = path_or_fh
+    elif isinstance(path_or_fh, (bytes, bytearray, memoryview)):
+        # Frames are decoded in another process, so the buffer needs to be picklable
+        source = bytes(path_or_fh)
+    else:
+        source = await loop.run_in_executor(None, path_or_fh.read)
+    frame_count, frames = await loop.run_in_executor(executor or _get_executor(), extract_frames, source, max_frames)
+
+    scenes = cluster_frames(frames, threshold)[:max_lookups]
+    logging.getLogger(__name__).debug(f"Sampled {len(frames)} of {frame_count} frames into {len(scenes)} scenes")
+
+    # Lookups are made one at a time so we don't burn through the short search limit all at once
+    deadline = Deadline.of(timeout)
+    log = logging.getLogger(__name__)
+    scene_results = []
+    error = None
+    for scene in scenes:
+        try:
+            results = await sauce.from_file(scene.representative.image, timeout=deadline)
+        except (SauceNaoException, aiohttp.ClientError) as e:
+            if not scene_results:
+                raise
+
+            log.warning(f"Returning {len(scene_results)} of {len(scenes)} scenes after a failed lookup: {e}")
+            error = e
+            break
+
+        scene_results.append(results)
+        if results.short_remaining is not None and results.short_remaining <= 0 and len(scene_results) < len(scenes):
+            log.info(f"Short search limit reached, returning {len(scene_results)} of {len(scenes)} scenes")
+            break
+
+    return FrameSearchResults(scenes[:len(scene_results)], scene_results, frame_count, error)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor()
+
+    return _executor
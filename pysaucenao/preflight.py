@@ -0,0 +1,215 @@
+import collections
+import struct
+import time
+import typing
+
+from pysaucenao.errors import *
+
+# How much of a file we read to identify it. JPEG dimensions can occasionally sit past this point (e.g. after a large
+# EXIF thumbnail), in which case we simply don't check them locally
+HEADER_SIZE = 64 * 1024
+
+MAX_FILE_SIZE   = 20 * 1024 * 1024
+MIN_DIMENSION   = 8
+
+FORMAT_JPEG = 'jpeg'
+FORMAT_PNG  = 'png'
+FORMAT_GIF  = 'gif'
+FORMAT_WEBP = 'webp'
+FORMAT_BMP  = 'bmp'
+
+# Errors that will always be returned for the same input, and are therefore safe to cache
+CACHEABLE_ERRORS = (InvalidImageException, FileSizeLimitException, ImageSizeException)
+
+
+class ImageInfo:
+    """
+    Image format and dimensions, as read from the file header
+    """
+
+    def __init__(self, format: str, width: typing.Optional[int] = None, height: typing.Optional[int] = None):
+        self.format = format
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return f"<ImageInfo(format='{self.format}', width={self.width}, height={self.height})>"
+
+
+def sniff_image(header: bytes) -> typing.Optional[ImageInfo]:
+    """
+    Identify an image from its magic bytes and read its dimensions, without decoding it
+    Args:
+        header (bytes): The first HEADER_SIZE bytes of the file
+
+    Raises:
+        InvalidImageException: The file is too short to contain a valid image header
+
+    Returns:
+        typing.Optional[ImageInfo]: None if the data is not in a format SauceNao supports
+    """
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        _require(header, 24, FORMAT_PNG)
+        if header[12:16] == b'IHDR':
+            return ImageInfo(FORMAT_PNG, *struct.unpack('>II', header[16:24]))
+        return ImageInfo(FORMAT_PNG)
+
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        _require(header, 10, FORMAT_GIF)
+        return ImageInfo(FORMAT_GIF, *struct.unpack('<HH', header[6:10]))
+
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return _sniff_webp(header)
+
+    if header[:2] == b'BM':
+        _require(header, 26, FORMAT_BMP)
+        width, height = struct.unpack('<ii', header[18:26])
+        return ImageInfo(FORMAT_BMP, width, abs(height))
+
+    if header[:3] == b'\xff\xd8\xff':
+        return _sniff_jpeg(header)
+
+    return None
+
+
+def _require(header: bytes, length: int, format: str) -> None:
+    if len(header) < length:
+        raise InvalidImageException(f"File is too short to be a valid {format.upper()} image")
+
+
+def _sniff_webp(header: bytes) -> ImageInfo:
+    chunk = header[12:16]
+    if chunk == b'VP8 ' and len(header) >= 30:
+        width, height = struct.unpack('<HH', header[26:30])
+        return ImageInfo(FORMAT_WEBP, width & 0x3fff, height & 0x3fff)
+
+    if chunk == b'VP8L' and len(header) >= 25:
+        bits = int.from_bytes(header[21:25], 'little')
+        return ImageInfo(FORMAT_WEBP, (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1)
+
+    if chunk == b'VP8X' and len(header) >= 30:
+        width = int.from_bytes(header[24:27], 'little') + 1
+        height = int.from_bytes(header[27:30], 'little') + 1
+        return ImageInfo(FORMAT_WEBP, width, height)
+
+    return ImageInfo(FORMAT_WEBP)
+
+
+def _sniff_jpeg(header: bytes) -> ImageInfo:
+    # Walk the marker segments until we hit a start of frame marker, which contains the image dimensions
+    offset = 2
+    while offset + 9 <= len(header):
+        if header[offset] != 0xff:
+            break
+
+        marker = header[offset + 1]
+        if marker == 0xff:
+            # Fill byte
+            offset += 1
+            continue
+
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>HH', header[offset + 5:offset + 9])
+            return ImageInfo(FORMAT_JPEG, width, height)
+
+        length = struct.unpack('>H', header[offset + 2:offset + 4])[0]
+        offset += 2 + length
+
+    return ImageInfo(FORMAT_JPEG)
+
+
+def check_image(header: bytes, size: typing.Optional[int] = None, *,
+                max_file_size: int = MAX_FILE_SIZE,
+                min_dimension: int = MIN_DIMENSION) -> ImageInfo:
+    """
+    Verify an image is something SauceNao will accept before uploading it
+    Args:
+        header (bytes): The first HEADER_SIZE bytes of the file
+        size (typing.Optional[int]): The total size of the file, if known
+        max_file_size (int): Maximum file size in bytes
+        min_dimension (int): Minimum width and height in pixels
+
+    Raises:
+        InvalidImageException: The file is not a supported image format, or its header is truncated
+        FileSizeLimitException: The file is too large to upload
+        ImageSizeException: The image is too small to look up
+
+    Returns:
+        ImageInfo
+    """
+    if size is not None and size > max_file_size:
+        raise FileSizeLimitException(f"File size of {size} bytes exceeds the {max_file_size} byte upload limit")
+
+    info = sniff_image(header)
+    if info is None:
+        raise InvalidImageException('File is not a supported image format')
+
+    if info.width is not None and info.height is not None:
+        if info.width <= 0 or info.height <= 0:
+            raise InvalidImageException(f"Image has invalid dimensions ({info.width}x{info.height})")
+        if info.width < min_dimension or info.height < min_dimension:
+            raise ImageSizeException(f"Image dimensions ({info.width}x{info.height}) are too small")
+
+    return info
+
+
+class NegativeCache:
+    """
+    Remembers inputs SauceNao has rejected so repeat lookups fail instantly, without another round trip
+    Keys are either URL's or content hashes.
+    """
+
+    def __init__(self, ttl: float = 3600.0, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: typing.OrderedDict[str, typing.Tuple[float, SauceNaoException]] = collections.OrderedDict()
+
+    def get(self, key: str) -> typing.Optional[SauceNaoException]:
+        """
+        Get the cached error for a rejected input
+        Returns:
+            typing.Optional[SauceNaoException]: The original error, or None if the input hasn't been rejected recently
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires, error = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        return error
+
+    def check(self, key: str) -> None:
+        """
+        Re-raise the cached error for an input if it has already been rejected
+        Returns:
+            None
+        """
+        error = self.get(key)
+        if error is not None:
+            raise type(error)(*error.args)
+
+    def add(self, key: str, error: SauceNaoException) -> None:
+        """
+        Cache a rejected input. Errors that may not occur again (e.g. search limits) are ignored
+        Returns:
+            None
+        """
+        if not isinstance(error, CACHEABLE_ERRORS):
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, error)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __contains__(self, key: str):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._entries)
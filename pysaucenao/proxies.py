@@ -0,0 +1,179 @@
+import collections
+import logging
+import time
+import typing
+
+from aiohttp_proxy import ProxyConnector
+
+
+class ProxyStats:
+    """
+    Health statistics for a single proxy in a ProxyPool
+    """
+
+    def __init__(self, url: str):
+        self.url: str                           = url
+        self.latency: typing.Optional[float]    = None  # EWMA of successful request latency, in seconds
+        self.error_rate: float                  = 0.0   # EWMA of failures, between 0.0 and 1.0
+        self.failures: int                      = 0     # Consecutive failures since the last success
+        self.ejected_until: float               = 0.0
+        self.requests: int                      = 0
+        self.in_flight: int                     = 0
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until > time.monotonic()
+
+    def __repr__(self):
+        latency = f"{self.latency:.3f}" if self.latency is not None else None
+        return f"<ProxyStats(url='{self.url}', latency={latency}, error_rate={self.error_rate:.2f}, ejected={self.ejected})>"
+
+
+class ProxyPool:
+    """
+    A pool of proxies, each with its own pooled connector and health tracking.
+    Proxies that fail repeatedly are ejected from the pool and re-admitted on probation once their ejection time lapses.
+    """
+
+    def __init__(self, proxies: typing.Iterable[str], *,
+                 alpha: float = 0.2,
+                 max_failures: int = 3,
+                 ejection_time: float = 30.0,
+                 max_ejection_time: float = 600.0,
+                 hedge_percentile: float = 95.0,
+                 hedge_min_samples: int = 20,
+                 sample_size: int = 200):
+        self.proxies: typing.Dict[str, ProxyStats] = {url: ProxyStats(url) for url in proxies}
+        if not self.proxies:
+            raise ValueError('A proxy pool requires at least one proxy')
+
+        self._alpha = alpha
+        self._max_failures = max_failures
+        self._ejection_time = ejection_time
+        self._max_ejection_time = max_ejection_time
+        self._hedge_percentile = hedge_percentile
+        self._hedge_min_samples = hedge_min_samples
+        self._samples = collections.deque(maxlen=sample_size)
+        self._connectors: typing.Dict[str, ProxyConnector] = {}
+        self._log = logging.getLogger(__name__)
+
+    def connector(self, url: str) -> ProxyConnector:
+        """
+        Get the pooled connector for a proxy, creating it on first use
+        Connectors must be created from within a running event loop, so this should only be called from a coroutine
+        Args:
+            url (str): The proxy URL
+
+        Returns:
+            ProxyConnector
+        """
+        connector = self._connectors.get(url)
+        if connector is None or connector.closed:
+            connector = ProxyConnector.from_url(url)
+            self._connectors[url] = connector
+
+        return connector
+
+    def select(self, exclude: typing.Collection[str] = ()) -> typing.Optional[str]:
+        """
+        Select the healthiest available proxy
+        Args:
+            exclude (typing.Collection[str]): Proxies that should not be selected (e.g. one already in use for a request)
+
+        Returns:
+            typing.Optional[str]: The proxy URL, or None if every proxy has been excluded
+        """
+        candidates = [s for s in self.proxies.values() if s.url not in exclude]
+        if not candidates:
+            return None
+
+        healthy = [s for s in candidates if not s.ejected]
+        if not healthy:
+            # Every proxy is ejected; probe the one that is closest to being re-admitted rather than failing outright
+            stats = min(candidates, key=lambda s: s.ejected_until)
+            self._log.warning(f"All proxies are ejected, falling back to {stats.url}")
+            return stats.url
+
+        return min(healthy, key=self._score).url
+
+    def record_success(self, url: str, latency: float) -> None:
+        """
+        Record a successful request made through a proxy
+        Args:
+            url (str): The proxy URL
+            latency (float): Time taken to complete the request, in seconds
+
+        Returns:
+            None
+        """
+        stats = self.proxies[url]
+        stats.latency = latency if stats.latency is None else self._ewma(stats.latency, latency)
+        stats.error_rate = self._ewma(stats.error_rate, 0.0)
+        stats.failures = 0
+        self._samples.append(latency)
+
+    def record_failure(self, url: str) -> None:
+        """
+        Record a failed request made through a proxy, ejecting it from the pool if it has failed too many times in a row
+        Args:
+            url (str): The proxy URL
+
+        Returns:
+            None
+        """
+        stats = self.proxies[url]
+        stats.error_rate = self._ewma(stats.error_rate, 1.0)
+        stats.failures += 1
+
+        if stats.failures >= self._max_failures:
+            # Back off exponentially for proxies that keep failing after being re-admitted
+            ejection_time = min(self._ejection_time * 2 ** (stats.failures - self._max_failures),
+                                self._max_ejection_time)
+            stats.ejected_until = time.monotonic() + ejection_time
+            self._log.warning(f"Ejecting proxy {url} from the pool for {ejection_time:.0f} seconds")
+
+    def hedge_delay(self) -> typing.Optional[float]:
+        """
+        The latency threshold after which a hedged request should be sent through another proxy
+        Returns:
+            typing.Optional[float]: The configured latency percentile, or None if we don't have enough samples yet
+        """
+        if len(self._samples) < self._hedge_min_samples or len(self.proxies) < 2:
+            return None
+
+        samples = sorted(self._samples)
+        index = min(int(len(samples) * self._hedge_percentile / 100), len(samples) - 1)
+        return samples[index]
+
+    async def close(self) -> None:
+        """
+        Close all pooled connectors
+        Returns:
+            None
+        """
+        for connector in self._connectors.values():
+            await connector.close()
+        self._connectors.clear()
+
+    def _score(self, stats: ProxyStats) -> float:
+        latency = stats.latency
+        if latency is None:
+            # Idle proxies that haven't been sampled or failed yet are tried first, so every proxy gets sampled
+            if not stats.failures and not stats.in_flight:
+                return -1.0
+
+            # Otherwise assume they're as slow as the slowest request we've seen
+            latency = max(self._samples, default=1.0)
+
+        # Penalize error prone and busy proxies
+        return latency * (1 + stats.in_flight) * (1 + 4 * stats.error_rate)
+
+    def _ewma(self, current: float, value: float) -> float:
+        return self._alpha * value + (1 - self._alpha) * current
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def __repr__(self):
+        healthy = len([s for s in self.proxies.values() if not s.ejected])
+        return f"<ProxyPool(proxies={len(self.proxies)}, healthy={healthy})>"
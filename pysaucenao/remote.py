@@ -0,0 +1,142 @@
+import asyncio
+import io
+import json
+import typing
+
+import aiohttp
+
+from pysaucenao import errors
+from pysaucenao.containers import SauceNaoResults
+from pysaucenao.daemon import DEFAULT_PORT
+from pysaucenao.deadline import Deadline
+from pysaucenao.errors import *
+
+
+class RemoteSauceNao:
+    """
+    Client for a pysaucenao lookup daemon, with the same lookup API as SauceNao
+    """
+
+    def __init__(self, path: typing.Optional[str] = None, *,
+                 url: typing.Optional[str] = None,
+                 timeout: typing.Optional[float] = 60.0,
+                 merge_duplicates: bool = False,
+                 loop: typing.Optional[asyncio.AbstractEventLoop] = None):
+        """
+        Args:
+            path (typing.Optional[str]): Path to the daemon's Unix socket
+            url (typing.Optional[str]): Base URL of a daemon listening over TCP. Defaults to the daemon's default port
+            timeout (typing.Optional[float]): Default time limit for each lookup, in seconds
+            merge_duplicates (bool): Merge duplicate results from different indexes, see SauceNaoResults.merge_duplicates
+            loop (typing.Optional[asyncio.AbstractEventLoop]): Event loop to use
+        """
+        self.path = path
+        self.url = (url or f"http://127.0.0.1:{DEFAULT_PORT}").rstrip('/') if not path else 'http://pysaucenao'
+        self._timeout = timeout
+        self._merge_duplicates = merge_duplicates
+        self._loop = loop
+        self._session: typing.Optional[aiohttp.ClientSession] = None
+
+    async def from_url(self, url: str, *, timeout: typing.Optional[typing.Union[float, Deadline]] = None) \
+            -> SauceNaoResults:
+        """
+        Look up the source of an image on the internet
+        Args:
+            url (str): Web URL to an image
+            timeout (typing.Optional[typing.Union[float, Deadline]]): Time limit for the lookup in seconds, or a
+                Deadline to share with other calls
+
+        Returns:
+            SauceNaoResults
+        """
+        return await self._lookup({'url': url}, None, timeout)
+
+    async def from_file(self, path_or_fh: typing.Union[str, typing.BinaryIO, bytes, bytearray, memoryview], *,
+                        timeout: typing.Optional[typing.Union[float, Deadline]] = None) -> SauceNaoResults:
+        """
+        Look up the source of an image on the local filesystem
+        Args:
+            path_or_fh (typing.Union[str, typing.BinaryIO, bytes, bytearray, memoryview]): Path to the file to open,
+                a file like object, or a buffer containing the image
+            timeout (typing.Optional[typing.Union[float, Deadline]]): Time limit for the lookup in seconds, or a
+                Deadline to share with other calls
+
+        Returns:
+            SauceNaoResults
+        """
+        if isinstance(path_or_fh, (bytes, bytearray, memoryview, io.IOBase)):
+            return await self._lookup({}, path_or_fh, timeout)
+
+        loop = asyncio.get_event_loop()
+        fh = await loop.run_in_executor(None, open, path_or_fh, 'rb')
+        try:
+            return await self._lookup({}, fh, timeout)
+        finally:
+            await loop.run_in_executor(None, fh.close)
+
+    async def status(self) -> dict:
+        """
+        Get the daemon's scheduler statistics and last known search limits
+        Returns:
+            dict
+        """
+        async with self._get_session().get(f"{self.url}/status") as response:
+            return await response.json()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _lookup(self, params: dict, body: typing.Any,
+                      timeout: typing.Optional[typing.Union[float, Deadline]]) -> SauceNaoResults:
+        deadline = Deadline.of(timeout, self._timeout)
+        if deadline is not None:
+            # The daemon runs the lookup within our deadline, unless we've joined an identical lookup already in flight
+            params['timeout'] = f"{deadline.remaining:.3f}"
+
+        async def _request():
+            async with self._get_session().post(f"{self.url}/lookup", params=params, data=body) as response:
+                return response.status, response.content_type, await response.text()
+
+        try:
+            status, content_type, text = await deadline.run(_request()) if deadline else await _request()
+        except asyncio.TimeoutError as error:
+            raise RequestTimeoutException(str(error) or 'Request timed out') from error
+
+        # Anything other than JSON didn't come from the daemon, e.g. a proxy error page
+        if content_type != 'application/json':
+            raise UnknownStatusCodeException(f"HTTP {status}")
+
+        data = json.loads(text)
+        if status != 200 or 'error' in data:
+            raise self._exception(data.get('error'), data.get('message'))
+
+        results = SauceNaoResults(data['results'], loop=self._loop, deadline=deadline)
+        if self._merge_duplicates:
+            results.merge_duplicates()
+
+        return results
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # A single session is kept open, so connections to the daemon stay warm between lookups
+        if self._session is None or self._session.closed:
+            connector = aiohttp.UnixConnector(path=self.path) if self.path else None
+            self._session = aiohttp.ClientSession(connector=connector)
+
+        return self._session
+
+    @staticmethod
+    def _exception(name: typing.Optional[str], message: typing.Optional[str]) -> SauceNaoException:
+        # Re-raise the daemon's errors as the same exceptions SauceNao would have raised
+        error = getattr(errors, name or '', None)
+        if isinstance(error, type) and issubclass(error, SauceNaoException):
+            return error(message)
+
+        return UnknownStatusCodeException(f"{name}: {message}")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
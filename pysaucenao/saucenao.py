@@ -1,10 +1,19 @@
+import hashlib
 import io
+import mmap
+import time
 from typing import *
 
 from aiohttp_proxy import ProxyConnector
 
 from pysaucenao.containers import *
+from pysaucenao.deadline import Deadline
 from pysaucenao.errors import *
+from pysaucenao.preflight import HEADER_SIZE, NegativeCache, check_image
+from pysaucenao.proxies import ProxyPool
+
+if typing.TYPE_CHECKING:
+    from pysaucenao.frames import FrameSearchResults
 
 
 class SauceNao:
@@ -22,6 +31,14 @@ class SauceNao:
                  priority: typing.Optional[List] = None,
                  priority_tolerance: float = 10.0,
                  proxy: str = None,
+                 proxies: Optional[Union[List[str], ProxyPool]] = None,
+                 hedge_requests: bool = False,
+                 preflight: bool = True,
+                 negative_cache_ttl: Optional[float] = None,
+                 merge_duplicates: bool = False,
+                 timeout: Optional[float] = 60.0,
+                 connect_timeout: Optional[float] = 10.0,
+                 read_timeout: Optional[float] = 30.0,
                  loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
 
         params = dict()
@@ -41,59 +58,129 @@ class SauceNao:
         self._strict_mode = strict_mode
         self._priority = priority
         self._priority_tolerance = priority_tolerance
+        self._merge_duplicates = merge_duplicates
         self._loop = loop
         self._log = logging.getLogger(__name__)
         self.connector = ProxyConnector().from_url(proxy) if proxy else None
 
-    async def from_url(self, url: str) -> SauceNaoResults:
+        # Proxy pool mode; each proxy gets its own pooled connector and health tracking
+        if proxies is not None and not isinstance(proxies, ProxyPool):
+            proxies = ProxyPool(proxies)
+        self.proxy_pool: Optional[ProxyPool] = proxies
+        self._hedge_requests = hedge_requests
+
+        # Validate local files before uploading them, and optionally remember inputs SauceNao has already rejected
+        self._preflight = preflight
+        self.negative_cache: Optional[NegativeCache] = NegativeCache(negative_cache_ttl) if negative_cache_ttl else None
+
+        # The total timeout is enforced as a deadline spanning the entire lookup, rather than per HTTP request
+        self._timeout = timeout
+        self._client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+
+    async def from_url(self, url: str, *, hedge: Optional[bool] = None,
+                       timeout: Optional[Union[float, Deadline]] = None) -> SauceNaoResults:
         """
         Look up the source of an image on the internet
         Args:
             url (str): Web URL to an image
+            hedge (Optional[bool]): When using a proxy pool, send a second request through another proxy if the first
+                one is slow. This may use up two queries from your quota. Defaults to the client's hedge_requests setting
+            timeout (Optional[Union[float, Deadline]]): Time limit for the lookup in seconds, or a Deadline to share
+                with other calls. Defaults to the client's timeout setting
 
         Returns:
             SauceNaoResults
         """
+        deadline = Deadline.of(timeout, self._timeout)
+        cache_key = f"url:{url}"
+        if self.negative_cache is not None:
+            self.negative_cache.check(cache_key)
+
         params = self.params.copy()
         params['url'] = url
-        async with aiohttp.ClientSession(loop=self._loop, connector=self.connector) as session:
-            self._log.debug(f"""Executing SauceNAO API request on URL: {url}""")
-            status_code, response = await self._fetch(session, self.API_URL, params)
+        self._log.debug(f"""Executing SauceNAO API request on URL: {url}""")
+        status_code, response = await self._dispatch(
+            lambda session: self._fetch(session, self.API_URL, params),
+            self._hedge_requests if hedge is None else hedge,
+            deadline
+        )
 
-        self._verify_request(status_code, response)
-        return SauceNaoResults(response, self._min_similarity, self._priority, self._priority_tolerance, self._loop)
+        self._verify_request(status_code, response, cache_key)
+        return self._build_results(response, deadline)
 
     # noinspection PyTypeChecker
-    async def from_file(self, path_or_fh: Union[str, typing.BinaryIO]) -> SauceNaoResults:
+    async def from_file(self, path_or_fh: Union[str, typing.BinaryIO, bytes, bytearray, memoryview, mmap.mmap], *,
+                        timeout: Optional[Union[float, Deadline]] = None) -> SauceNaoResults:
         """
         Look up the source of an image on the local filesystem
+        Files are opened and read in chunks off of the event loop, so slow disks won't stall other coroutines.
+        In-memory images (including mmap-backed buffers) are uploaded directly without being copied.
         Args:
-            path_or_fh (typing.Union[str, typing.BinaryIO]): Path to the file to open or a file like object
+            path_or_fh (typing.Union[str, typing.BinaryIO, bytes, bytearray, memoryview, mmap.mmap]): Path to the file
+                to open, a file like object, or a buffer containing the image
+            timeout (Optional[Union[float, Deadline]]): Time limit for the lookup in seconds, or a Deadline to share
+                with other calls. Defaults to the client's timeout setting
 
         Returns:
             SauceNaoResults
         """
         params = self.params.copy()
+        loop = asyncio.get_event_loop()
+        deadline = Deadline.of(timeout, self._timeout)
 
-        async def _post(_fh: typing.IO):
-            params['file'] = _fh
-            async with aiohttp.ClientSession(loop=self._loop, connector=self.connector) as _session:
-                self._log.debug(f"Executing SauceNAO API request on local file: {path_or_fh}")
-                _status_code, _response = await self._post(_session, self.API_URL, params)
-                return _status_code, _response
+        # File uploads are never hedged, as an upload can't be streamed through two connections at once
+        if isinstance(path_or_fh, (bytes, bytearray, memoryview, mmap.mmap)):
+            view = memoryview(path_or_fh).cast('B')
+            cache_key = await self._within(deadline, self._inspect_buffer(view))
 
-        if not isinstance(path_or_fh, io.IOBase):
-            with open(path_or_fh, 'rb') as fh:
-                status_code, response = await _post(fh)
+            form = aiohttp.FormData(params)
+            form.add_field('file', view, filename='image', content_type='application/octet-stream')
+            self._log.debug(f"Executing SauceNAO API request on a {len(view)} byte buffer")
+            status_code, response = await self._dispatch(lambda session: self._post(session, self.API_URL, form),
+                                                         deadline=deadline)
         else:
-            status_code, response = await _post(path_or_fh)
+            opened = not isinstance(path_or_fh, io.IOBase)
+            fh = path_or_fh
+            if opened:
+                fh = await self._within(deadline, loop.run_in_executor(None, open, path_or_fh, 'rb'))
+            try:
+                cache_key = await self._within(deadline, self._inspect_file(fh))
+
+                # aiohttp reads file payloads in chunks from a thread pool, so the upload itself won't block either
+                params['file'] = fh
+                self._log.debug(f"Executing SauceNAO API request on local file: {path_or_fh}")
+                status_code, response = await self._dispatch(lambda session: self._post(session, self.API_URL, params),
+                                                             deadline=deadline)
+            finally:
+                if opened:
+                    await loop.run_in_executor(None, fh.close)
+
+        self._verify_request(status_code, response, cache_key)
+        return self._build_results(response, deadline)
 
-        self._verify_request(status_code, response)
-        return SauceNaoResults(response, self._min_similarity, self._priority, self._priority_tolerance, self._loop)
+    async def from_animated_file(self, path_or_fh: Union[str, typing.BinaryIO, bytes, bytearray, memoryview], *,
+                                 max_lookups: int = 4, **kwargs) -> 'FrameSearchResults':
+        """
+        Look up the source of an animated GIF, WebP or APNG on the local filesystem.
+        Frames are sampled and grouped into scenes, and one frame from each scene is looked up. Requires Pillow.
+        Args:
+            path_or_fh (typing.Union[str, typing.BinaryIO, bytes, bytearray, memoryview]): Path to the file to open,
+                a file like object, or a buffer containing the image
+            max_lookups (int): Maximum number of scenes to look up. Each lookup uses a query from your quota
+            **kwargs: Additional sampling options passed to pysaucenao.frames.lookup_frames
+
+        Returns:
+            FrameSearchResults
+        """
+        from pysaucenao.frames import lookup_frames
+        return await lookup_frames(self, path_or_fh, max_lookups=max_lookups, **kwargs)
 
-    async def test(self) -> TestResults:
+    async def test(self, *, timeout: Optional[Union[float, Deadline]] = None) -> TestResults:
         """
         Executes a test query and returns account information for the provided API key
+        Args:
+            timeout (Optional[Union[float, Deadline]]): Time limit for the query in seconds, or a Deadline to share
+
         Returns:
             TestResults
         """
@@ -102,9 +189,9 @@ class SauceNao:
         params['numres'] = '1'
         params['url'] = 'http://saucenao.com/images/static/banner.gif'
 
-        async with aiohttp.ClientSession(loop=self._loop, connector=self.connector) as session:
-            self._log.debug('Executing a test SauceNao API request')
-            status_code, response = await self._fetch(session, self.API_URL, params)
+        self._log.debug('Executing a test SauceNao API request')
+        status_code, response = await self._dispatch(lambda session: self._fetch(session, self.API_URL, params),
+                                                     deadline=Deadline.of(timeout, self._timeout))
 
         # For test queries, we just grab and store the exception on failure
         error = None
@@ -115,12 +202,205 @@ class SauceNao:
 
         return TestResults(response, error)
 
-    def _verify_request(self, status_code: int, data: dict) -> None:
+    async def close(self) -> None:
+        """
+        Close any pooled proxy connections
+        Returns:
+            None
+        """
+        if self.proxy_pool:
+            await self.proxy_pool.close()
+
+    async def _inspect_file(self, fh: typing.BinaryIO) -> Optional[str]:
+        """
+        Run pre-flight checks on a file before uploading it, rejecting anything SauceNao would refuse to process
+        Returns:
+            Optional[str]: The negative cache key for the file, if the negative cache is enabled
+        """
+        # We need to be able to rewind the file after reading from it
+        if not (self._preflight or self.negative_cache is not None) or not fh.seekable():
+            return None
+
+        def _read():
+            start = fh.tell()
+            try:
+                header = fh.read(HEADER_SIZE)
+                size = fh.seek(0, io.SEEK_END) - start
+
+                digest = None
+                if self.negative_cache is not None:
+                    fh.seek(start)
+                    sha1 = hashlib.sha1()
+                    for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+                        sha1.update(chunk)
+                    digest = sha1.hexdigest()
+            finally:
+                fh.seek(start)
+
+            return header, size, digest
+
+        header, size, digest = await asyncio.get_event_loop().run_in_executor(None, _read)
+        return self._check_upload(header, size, digest)
+
+    async def _inspect_buffer(self, view: memoryview) -> Optional[str]:
+        """
+        Run pre-flight checks on an in-memory image before uploading it
+        Returns:
+            Optional[str]: The negative cache key for the image, if the negative cache is enabled
+        """
+        digest = None
+        if self.negative_cache is not None:
+            # Hashing large buffers can take a while, and hashlib releases the GIL, so do it in a thread
+            digest = await asyncio.get_event_loop().run_in_executor(None, lambda: hashlib.sha1(view).hexdigest())
+
+        return self._check_upload(view[:HEADER_SIZE].tobytes(), len(view), digest)
+
+    def _check_upload(self, header: bytes, size: int, digest: Optional[str]) -> Optional[str]:
+        if self._preflight:
+            check_image(header, size)
+
+        cache_key = f"sha1:{digest}" if digest else None
+        if cache_key:
+            self.negative_cache.check(cache_key)
+
+        return cache_key
+
+    def _build_results(self, response: dict, deadline: Optional[Deadline]) -> SauceNaoResults:
+        results = SauceNaoResults(response, self._min_similarity, self._priority, self._priority_tolerance, self._loop,
+                                  deadline)
+        if self._merge_duplicates:
+            removed = results.merge_duplicates()
+            if removed:
+                self._log.debug(f"Merged {removed} duplicate results")
+
+        return results
+
+    async def _within(self, deadline: Optional[Deadline], awaitable: Awaitable) -> Any:
+        """
+        Await something within a deadline, raising a RequestTimeoutException if it or a connect / read timeout passes
+        """
+        if deadline is not None:
+            return await deadline.run(awaitable)
+
+        try:
+            return await awaitable
+        except asyncio.TimeoutError as error:
+            raise RequestTimeoutException(str(error) or 'Request timed out') from error
+
+    async def _dispatch(self, request: Callable[[aiohttp.ClientSession], Awaitable[Tuple[int, dict]]],
+                        hedge: bool = False, deadline: Optional[Deadline] = None) -> Tuple[int, dict]:
+        """
+        Execute a request, routing it through the proxy pool if one has been configured
+        Args:
+            request (Callable): Coroutine function that performs the request using the provided session
+            hedge (bool): Send a second request through another proxy if the first exceeds the pool's latency percentile
+            deadline (Optional[Deadline]): Cancel the request (including any hedged request) once this deadline passes
+
+        Returns:
+            Tuple[int, dict]
+        """
+        started: List[Tuple[asyncio.Future, str]] = []  # Proxied requests and the proxy each was sent through
+        try:
+            return await self._within(deadline, self._route(request, hedge, started))
+        except RequestTimeoutException:
+            # Requests the deadline cut off count against their proxy, so proxies that silently drop traffic get ejected.
+            # Ones that finished on their own have already been recorded
+            for task, proxy in started:
+                if task.cancelled() or not task.done():
+                    self.proxy_pool.record_failure(proxy)
+            raise
+
+    async def _route(self, request: Callable[[aiohttp.ClientSession], Awaitable[Tuple[int, dict]]],
+                     hedge: bool = False, started: Optional[List[Tuple[asyncio.Future, str]]] = None) \
+            -> Tuple[int, dict]:
+        if not self.proxy_pool:
+            async with aiohttp.ClientSession(loop=self._loop, connector=self.connector,
+                                             timeout=self._client_timeout) as session:
+                return await request(session)
+
+        pool = self.proxy_pool
+        primary = pool.select()
+        first = asyncio.ensure_future(self._proxied_request(primary, request))
+        started = started if started is not None else []
+        started.append((first, primary))
+
+        delay = pool.hedge_delay() if hedge else None
+        if delay is None:
+            return await first
+
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+        except asyncio.CancelledError:
+            # asyncio.wait doesn't cancel what it's waiting on, so make sure the request doesn't outlive its deadline
+            first.cancel()
+            raise
+
+        secondary = pool.select(exclude=[primary])
+        if done or secondary is None:
+            return await first
+
+        self._log.debug(f"Request through {primary} exceeded {delay:.3f} seconds, hedging through {secondary}")
+        second = asyncio.ensure_future(self._proxied_request(secondary, request))
+        started.append((second, secondary))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise error
+
+    async def _proxied_request(self, proxy: str,
+                               request: Callable[[aiohttp.ClientSession], Awaitable[Tuple[int, dict]]]) -> Tuple[int, dict]:
+        """
+        Execute a request through a specific proxy in the pool, recording its latency and any connection errors
+        Returns:
+            Tuple[int, dict]
+        """
+        stats = self.proxy_pool.proxies[proxy]
+        stats.requests += 1
+        stats.in_flight += 1
+        start = time.monotonic()
+        try:
+            # The connector is owned by the pool, so it must survive the session being closed
+            async with aiohttp.ClientSession(loop=self._loop, connector=self.proxy_pool.connector(proxy),
+                                             connector_owner=False, timeout=self._client_timeout) as session:
+                result = await request(session)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.proxy_pool.record_failure(proxy)
+            raise
+        finally:
+            stats.in_flight -= 1
+
+        self.proxy_pool.record_success(proxy, time.monotonic() - start)
+        return result
+
+    def _verify_request(self, status_code: int, data: dict, cache_key: Optional[str] = None) -> None:
         """
         Verify that our request went through successfully
+        Args:
+            status_code (int): The HTTP status code of the response
+            data (dict): The decoded response
+            cache_key (Optional[str]): Negative cache key to remember the input under if it was rejected
+
         Returns:
             None
         """
+        try:
+            self._check_response(status_code, data)
+        except SauceNaoException as error:
+            if cache_key and self.negative_cache is not None:
+                self.negative_cache.add(cache_key, error)
+            raise
+
+    def _check_response(self, status_code: int, data: dict) -> None:
         if status_code == 200:
             header = data['header']
             # Technically, an invalid API key will still be accepted and can return results. We will just be processing
@@ -176,6 +456,7 @@ class SauceNao:
         async with session.get(url, params=params) as response:
             return response.status, await response.json()
 
-    async def _post(self, session: aiohttp.ClientSession, url: str, params: Optional[Mapping[str, str]] = None) -> Tuple[int, dict]:
+    async def _post(self, session: aiohttp.ClientSession, url: str,
+                    params: Optional[Union[Mapping[str, Any], aiohttp.FormData]] = None) -> Tuple[int, dict]:
         async with session.post(url, data=params) as response:
             return response.status, await response.json()
@@ -0,0 +1,287 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import typing
+
+import aiohttp
+
+from pysaucenao.containers import SauceNaoResults
+from pysaucenao.errors import *
+from pysaucenao.saucenao import SauceNao
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.jfif')
+
+STATUS_OK        = 'ok'
+STATUS_REJECTED  = 'rejected'
+STATUS_DUPLICATE = 'duplicate'  # Identical to another file; its result is journaled under the same sha1
+
+# SauceNao will never accept these files, so there's no point in querying them again when resuming
+PERMANENT_ERRORS = (InvalidImageException, FileSizeLimitException, ImageSizeException)
+
+# Every other lookup would fail the same way, so the scan is stopped instead
+FATAL_ERRORS = (DailyLimitReachedException, TooManyFailedRequestsException, InvalidOrWrongApiKeyException,
+                BannedException)
+
+
+class ScanJournal:
+    """
+    Append-only JSONL journal of completed lookups, used to resume interrupted scans
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._hashes: typing.Set[str] = set()
+        self._files: typing.Dict[str, typing.Tuple[int, int]] = {}
+        self._log = logging.getLogger(__name__)
+        self._load()
+        self._fh = open(path, 'a', encoding='utf-8')
+
+    def _load(self) -> None:
+        """
+        Load previously completed entries from the journal
+        Returns:
+            None
+        """
+        if not os.path.exists(self.path):
+            return
+
+        end = 0  # Offset just past the last complete line
+        with open(self.path, 'rb') as fh:
+            for line_no, line in enumerate(fh, 1):
+                if not line.endswith(b'\n'):
+                    # A partially written last line from a crash; it's truncated below so new entries start cleanly
+                    self._log.warning(f"Discarding partially written journal entry on line {line_no}")
+                    break
+
+                end += len(line)
+                try:
+                    entry = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    self._log.warning(f"Skipping malformed journal entry on line {line_no}")
+                    continue
+
+                if entry.get('status') != STATUS_DUPLICATE:
+                    self._hashes.add(entry['sha1'])
+                self._files[entry['path']] = (entry['size'], entry['mtime_ns'])
+
+        if os.path.getsize(self.path) != end:
+            os.truncate(self.path, end)
+
+        self._log.info(f"Loaded {len(self._hashes)} completed lookups from {self.path}")
+
+    def is_done(self, path: str, stat: os.stat_result) -> bool:
+        """
+        Check whether an unmodified file has already been looked up, without having to hash it again
+        """
+        return self._files.get(path) == (stat.st_size, stat.st_mtime_ns)
+
+    def has_hash(self, sha1: str) -> bool:
+        """
+        Check whether a file with this content has already been looked up
+        """
+        return sha1 in self._hashes
+
+    def write(self, path: str, stat: os.stat_result, sha1: str, status: str, **fields) -> None:
+        """
+        Append an entry to the journal and flush it to disk immediately
+        Returns:
+            None
+        """
+        entry = {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': sha1, 'status': status,
+                 'time': int(time.time())}
+        entry.update(fields)
+
+        self._fh.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._fh.flush()
+        if status != STATUS_DUPLICATE:
+            self._hashes.add(sha1)
+        self._files[path] = (stat.st_size, stat.st_mtime_ns)
+
+    def close(self) -> None:
+        self._fh.close()
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+class DirectoryScanner:
+    """
+    Resumable source lookups for every image in a directory tree
+    """
+
+    def __init__(self, sauce: SauceNao, journal: ScanJournal, *,
+                 concurrency: int = 2,
+                 extensions: typing.Iterable[str] = IMAGE_EXTENSIONS,
+                 short_cooldown: float = 30.0):
+        self.sauce = sauce
+        self.journal = journal
+        self.concurrency = concurrency
+        self.extensions = tuple(e.lower() for e in extensions)
+        self.short_cooldown = short_cooldown
+
+        self.stats: typing.Dict[str, int] = {'queued': 0, 'skipped': 0, 'duplicate': 0, 'ok': 0, 'rejected': 0,
+                                             'failed': 0}
+        self._queue: typing.Optional[asyncio.Queue] = None
+        self._stop: typing.Optional[asyncio.Event] = None
+        self._cooldown_until = 0.0
+        self._seen: typing.Set[str] = set()
+        self._log = logging.getLogger(__name__)
+
+    @property
+    def stopped(self) -> bool:
+        """
+        Whether the scan was stopped early due to search limits, or an invalid or banned API key
+        """
+        return bool(self._stop and self._stop.is_set())
+
+    def walk(self, directory: str) -> typing.Iterator[typing.Tuple[str, os.stat_result]]:
+        """
+        Lazily walk a directory tree, yielding image files and their stat results
+        """
+        try:
+            entries = os.scandir(directory)
+        except OSError as error:
+            self._log.warning(f"Unable to read directory {directory}: {error}")
+            return
+
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from self.walk(entry.path)
+                    elif entry.is_file() and entry.name.lower().endswith(self.extensions):
+                        yield entry.path, entry.stat()
+                except OSError as error:
+                    self._log.warning(f"Unable to read {entry.path}: {error}")
+
+    async def run(self, directory: str) -> typing.Dict[str, int]:
+        """
+        Scan a directory, stopping early if the daily search limit is reached or the API key is rejected
+        Args:
+            directory (str): Path to the directory to scan
+
+        Returns:
+            typing.Dict[str, int]: Scan statistics
+        """
+        self._queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        self._stop = asyncio.Event()
+        workers = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+
+        try:
+            await self._produce(os.path.abspath(directory))
+            for _ in workers:
+                await self._queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        return self.stats
+
+    async def _produce(self, directory: str) -> None:
+        """
+        Walk the directory tree and queue up every file that hasn't been looked up yet
+        Returns:
+            None
+        """
+        loop = asyncio.get_event_loop()
+        walker = self.walk(directory)
+
+        while not self._stop.is_set():
+            # Directory listings and hashing both hit the disk, so keep them off of the event loop
+            item = await loop.run_in_executor(None, next, walker, None)
+            if item is None:
+                break
+
+            path, stat = item
+            if self.journal.is_done(path, stat):
+                self.stats['skipped'] += 1
+                continue
+
+            sha1 = await loop.run_in_executor(None, self._hash, path)
+            if sha1 is None:
+                continue
+
+            if self.journal.has_hash(sha1) or sha1 in self._seen:
+                self._log.debug(f"Skipping duplicate file {path}")
+                self.journal.write(path, stat, sha1, STATUS_DUPLICATE)
+                self.stats['duplicate'] += 1
+                continue
+
+            self._seen.add(sha1)
+            self.stats['queued'] += 1
+            await self._queue.put((path, stat, sha1))
+
+    async def _worker(self) -> None:
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+
+            # Keep draining the queue after stopping so the producer is never left blocked
+            if self._stop.is_set():
+                continue
+
+            try:
+                await self._lookup(*item)
+            except Exception:
+                # A worker that dies here would leave the producer blocked on a full queue forever
+                self._log.exception(f"Lookup failed for {item[0]}")
+                self.stats['failed'] += 1
+
+    async def _lookup(self, path: str, stat: os.stat_result, sha1: str) -> None:
+        """
+        Look up a single file and record the outcome in the journal
+        Returns:
+            None
+        """
+        while not self._stop.is_set():
+            delay = self._cooldown_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            try:
+                results = await self.sauce.from_file(path)
+            except ShortLimitReachedException:
+                self._log.info(f"Short search limit reached, pausing for {self.short_cooldown:.0f} seconds")
+                self._cooldown_until = time.monotonic() + self.short_cooldown
+                continue
+            except FATAL_ERRORS as error:
+                self._log.warning(f"Stopping scan: {error}")
+                self._stop.set()
+                return
+            except PERMANENT_ERRORS as error:
+                self.journal.write(path, stat, sha1, STATUS_REJECTED, error=type(error).__name__, message=str(error))
+                self.stats['rejected'] += 1
+                return
+            except (SauceNaoException, aiohttp.ClientError, asyncio.TimeoutError, OSError) as error:
+                # Left out of the journal so the file will be retried on the next run
+                self._log.error(f"Lookup failed for {path}: {type(error).__name__} {error}")
+                self.stats['failed'] += 1
+                return
+
+            self.journal.write(path, stat, sha1, STATUS_OK, results=self._serialize(results))
+            self.stats['ok'] += 1
+            if results.short_remaining is not None and results.short_remaining <= 0:
+                self._cooldown_until = time.monotonic() + self.short_cooldown
+            return
+
+    def _hash(self, path: str) -> typing.Optional[str]:
+        sha1 = hashlib.sha1()
+        try:
+            with open(path, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+                    sha1.update(chunk)
+        except OSError as error:
+            self._log.warning(f"Unable to read {path}: {error}")
+            return None
+
+        return sha1.hexdigest()
+
+    @staticmethod
+    def _serialize(results: SauceNaoResults) -> typing.List[dict]:
+        return [{'header': r.header, 'data': r.data} for r in results]
@@ -0,0 +1,259 @@
+import asyncio
+import collections
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import typing
+
+import aiohttp
+
+MAX_THUMBNAIL_SIZE = 2 * 1024 * 1024
+
+
+class ThumbnailCache:
+    """
+    Content-addressed on-disk thumbnail cache with least-recently-used eviction
+    Thumbnail URL's are indexed on disk as well, so the cache can be shared between processes and survives restarts.
+    Each process keeps its own LRU table, loaded from disk on first use, and only counts what it has seen itself
+    towards max_bytes. A directory shared by several processes can therefore grow past max_bytes until one restarts.
+    """
+
+    def __init__(self, directory: typing.Optional[str] = None, max_bytes: int = 256 * 1024 * 1024,
+                 low_water: float = 0.9):
+        """
+        Args:
+            directory (typing.Optional[str]): Cache directory. Defaults to a directory in the system temp directory
+            max_bytes (int): Evict thumbnails once the cache grows past this size
+            low_water (float): Once evicting, keep going until the cache is down to this fraction of max_bytes, so we
+                aren't evicting again on every write
+        """
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'pysaucenao-thumbnails')
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self._entries: typing.Optional[typing.OrderedDict[str, int]] = None  # Path -> size, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self._log = logging.getLogger(__name__)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _index_path(self, url: str) -> str:
+        # Each URL maps to a small file containing the content digest of its thumbnail
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, 'urls', key[:2], key)
+
+    def get(self, url: str) -> typing.Optional[str]:
+        """
+        Get the cached path for a thumbnail URL we've already downloaded, marking it as recently used
+        Returns:
+            typing.Optional[str]
+        """
+        index_path = self._index_path(url)
+        try:
+            with open(index_path, 'r') as fh:
+                digest = fh.read().strip()
+        except OSError:
+            return None
+
+        path = self.path(digest)
+        try:
+            os.utime(path)
+        except OSError:
+            # Evicted or removed by something else
+            self._remove(index_path)
+            return None
+
+        with self._lock:
+            self._touch(path)
+
+        return path
+
+    def put(self, url: str, data: bytes) -> str:
+        """
+        Store a thumbnail in the cache, evicting the least recently used thumbnails if we're over our size limit
+        Safe to call from several threads at once
+        Returns:
+            str: Path to the cached thumbnail
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+
+        # Identical thumbnails served from different (signed) URL's are only stored once
+        if os.path.exists(path):
+            os.utime(path)
+            with self._lock:
+                self._touch(path)
+        else:
+            tmp_path = self._write_temp(path, data)
+            with self._lock:
+                if os.path.exists(path):
+                    # Another thread stored the same thumbnail while we were writing ours
+                    os.remove(tmp_path)
+                    self._touch(path)
+                else:
+                    os.replace(tmp_path, path)
+                    self._touch(path, len(data))
+                    if self._size > self.max_bytes:
+                        self._evict(keep=path)
+
+        index_path = self._index_path(url)
+        os.replace(self._write_temp(index_path, digest.encode('ascii')), index_path)
+        return path
+
+    @staticmethod
+    def _write_temp(path: str, data: bytes) -> str:
+        # Written to a unique temporary file next to path first, so readers never see a partially written file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+
+        return tmp_path
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _touch(self, path: str, size: typing.Optional[int] = None) -> None:
+        """
+        Mark a thumbnail as the most recently used, adding it to the LRU table if we haven't seen it yet
+        Must be called while holding self._lock
+        """
+        entries = self._load()
+        if path in entries:
+            entries.move_to_end(path)
+            return
+
+        if size is None:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return
+
+        entries[path] = size
+        self._size += size
+
+    def _load(self) -> typing.OrderedDict[str, int]:
+        """
+        Build the LRU table from what's already on disk. This is only done once per instance
+        Must be called while holding self._lock
+        """
+        if self._entries is not None:
+            return self._entries
+
+        stats = []
+        for path in self._files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Removed by another process since we listed it
+                continue
+            stats.append((stat.st_atime_ns, path, stat.st_size))
+
+        self._entries = collections.OrderedDict((path, size) for _, path, size in sorted(stats))
+        self._size = sum(self._entries.values())
+        return self._entries
+
+    def _evict(self, keep: typing.Optional[str] = None) -> None:
+        """
+        Evict the least recently used thumbnails until we're down to the low water mark
+        Must be called while holding self._lock
+        """
+        entries = self._load()
+        target = self.max_bytes * self.low_water
+        for path in list(entries):
+            if self._size <= target:
+                break
+            if path == keep:
+                continue
+
+            self._size -= entries.pop(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Already removed by another process
+                continue
+            except OSError as error:
+                self._log.warning(f"Unable to evict {path} from the thumbnail cache: {error}")
+                continue
+
+            self._log.debug(f"Evicted {path} from the thumbnail cache")
+
+    def _files(self) -> typing.Iterator[str]:
+        # Cached thumbnails, skipping the URL index and any partially written files
+        for root, dirs, files in os.walk(self.directory):
+            if root == self.directory and 'urls' in dirs:
+                dirs.remove('urls')
+            for name in files:
+                if not name.endswith('.tmp'):
+                    yield os.path.join(root, name)
+
+    def __repr__(self):
+        return f"<ThumbnailCache(directory='{self.directory}', max_bytes={self.max_bytes})>"
+
+
+async def prefetch_thumbnails(urls: typing.Sequence[str], *,
+                              cache: typing.Optional[ThumbnailCache] = None,
+                              concurrency: int = 4,
+                              max_size: int = MAX_THUMBNAIL_SIZE,
+                              timeout: float = 10.0,
+                              loop: typing.Optional[asyncio.AbstractEventLoop] = None) \
+        -> typing.List[typing.Optional[typing.Union[str, bytes]]]:
+    """
+    Download thumbnails concurrently over a single pooled session
+    Args:
+        urls (typing.Sequence[str]): Thumbnail URL's to download
+        cache (typing.Optional[ThumbnailCache]): Cache to store thumbnails in. If not provided, the raw bytes are returned
+        concurrency (int): Maximum number of simultaneous downloads
+        max_size (int): Thumbnails larger than this many bytes are skipped
+        timeout (float): Total time allowed for each download, in seconds
+        loop (typing.Optional[asyncio.AbstractEventLoop]): Event loop to use
+
+    Returns:
+        typing.List[typing.Optional[typing.Union[str, bytes]]]: Local paths (or bytes) in the same order as the URL's
+            provided, with None for any thumbnails that could not be downloaded
+    """
+    _loop = loop or asyncio.get_event_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    log = logging.getLogger(__name__)
+
+    async def _download(session: aiohttp.ClientSession, url: str) -> typing.Optional[typing.Union[str, bytes]]:
+        if cache is not None:
+            path = await _loop.run_in_executor(None, cache.get, url)
+            if path:
+                return path
+
+        async with semaphore:
+            try:
+                async with session.get(url) as response:
+                    if response.content_length and response.content_length > max_size:
+                        log.info(f"Skipping thumbnail larger than {max_size} bytes: {url}")
+                        return None
+
+                    # Content-Length may be missing or wrong, so enforce the limit while reading too
+                    data = bytearray()
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        data += chunk
+                        if len(data) > max_size:
+                            log.info(f"Skipping thumbnail larger than {max_size} bytes: {url}")
+                            return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                log.warning(f"Failed to download thumbnail {url}: {type(error).__name__} {error}")
+                return None
+
+        if cache is None:
+            return bytes(data)
+
+        return await _loop.run_in_executor(None, cache.put, url, bytes(data))
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, raise_for_status=True,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        return list(await asyncio.gather(*[_download(session, url) for url in urls]))
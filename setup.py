@@ -20,10 +20,16 @@ setup(
         url='https://github.com/FujiMakoto/pysaucenao',  # Provide either the link to your github or to your website
         download_url='https://github.com/FujiMakoto/pysaucenao/archive/1.6.2.tar.gz',
         keywords=['saucenao', 'anime', 'artwork'],  # Keywords that define your package best
+        entry_points={
+            'console_scripts': ['pysaucenao=pysaucenao.cli:main'],
+        },
         install_requires=[
             'aiohttp',
             'aiohttp_proxy',
         ],
+        extras_require={
+            'frames': ['Pillow'],
+        },
         classifiers=[
             'Development Status :: 5 - Production/Stable',
             'Intended Audience :: Developers',